@@ -9,11 +9,21 @@ implements a `KasaAdapter` using `python-kasa`. The existing
 The API is async and designed to be called from Quart route handlers.
 """
 
+import asyncio
 import logging
-from datetime import datetime
+import time
+from collections import OrderedDict
 from ipaddress import ip_address, ip_network
-from typing import List, Dict, Optional
-from kasa.iot import IotPlug
+from typing import Callable, List, Dict, Optional, Tuple
+
+try:
+    from kasa import Discover
+    from kasa.iot import IotPlug
+except ImportError as exc:
+    Discover = IotPlug = None
+    _KASA_IMPORT_ERROR: Optional[ImportError] = exc
+else:
+    _KASA_IMPORT_ERROR = None
 
 try:
     import netifaces
@@ -25,7 +35,44 @@ from constants import ONELIGHT_LOG_NAME
 logger = logging.getLogger(ONELIGHT_LOG_NAME)
 
 
+# Cached broadcast target; interface lookups are comparatively expensive and
+# the result rarely changes while the app is running.
+BROADCAST_CACHE_TTL = 300.0
+_BROADCAST_CACHE = {"value": None, "expires": 0.0}
+
+
+def invalidate_broadcast_cache() -> None:
+    """Force the next get_broadcast_target() call to re-detect the network."""
+    _BROADCAST_CACHE["value"] = None
+    _BROADCAST_CACHE["expires"] = 0.0
+
+
+def _require_kasa() -> None:
+    """Raise RuntimeError if python-kasa could not be imported."""
+    if _KASA_IMPORT_ERROR is not None:
+        raise RuntimeError("python-kasa is not installed") from _KASA_IMPORT_ERROR
+
+
 def get_broadcast_target() -> Optional[str]:
+    """
+    Return the cached broadcast address for discovery, re-detecting it
+    once the cached value is older than BROADCAST_CACHE_TTL seconds.
+
+    Only successful detections are cached so a transient failure is retried
+    on the next call.
+    """
+    now = time.monotonic()
+    if _BROADCAST_CACHE["value"] is not None and now < _BROADCAST_CACHE["expires"]:
+        return _BROADCAST_CACHE["value"]
+
+    target = _detect_broadcast_target()
+    if target:
+        _BROADCAST_CACHE["value"] = target
+        _BROADCAST_CACHE["expires"] = now + BROADCAST_CACHE_TTL
+    return target
+
+
+def _detect_broadcast_target() -> Optional[str]:
     """
     Detect primary non-loopback network and return broadcast address for discovery.
 
@@ -51,7 +98,7 @@ def get_broadcast_target() -> Optional[str]:
 
         if "broadcast" in addrs_ipv4:
             target = addrs_ipv4["broadcast"]
-            logger.info(f"Broadcast target found: {target}")
+            logger.info("Broadcast target found: %s", target)
             return target
         logger.warning(
             f"No broadcast address could be found for interface '{default_iface}' (gateway={gateway})"
@@ -75,46 +122,160 @@ class DeviceAdapter:
     async def get_state(self) -> Dict:
         raise NotImplementedError()
 
+    async def close(self) -> None:
+        """Release any open connection held by the adapter."""
+        return None
+
+
+class AdapterCache:
+    """
+    Bounded LRU cache of adapters keyed by device id.
+
+    Entries older than `ttl` seconds are treated as missing, and the least
+    recently used entry is dropped once `maxsize` is exceeded. `on_evict` is
+    called with every adapter that leaves the cache.
+    """
+
+    def __init__(
+        self,
+        maxsize: int = 512,
+        ttl: float = 3600.0,
+        on_evict: Optional[Callable[[DeviceAdapter], None]] = None,
+    ):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.on_evict = on_evict
+        self._entries: "OrderedDict[int, tuple]" = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __contains__(self, key: int) -> bool:
+        return self.get(key) is not None
+
+    def get(self, key: int) -> Optional[DeviceAdapter]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        adapter, created = entry
+        if time.monotonic() - created > self.ttl:
+            self.pop(key)
+            return None
+        self._entries.move_to_end(key)
+        return adapter
+
+    def set(self, key: int, adapter: DeviceAdapter) -> None:
+        previous = self._entries.pop(key, None)
+        if previous is not None and previous[0] is not adapter:
+            self._evicted(previous[0])
+        self._entries[key] = (adapter, time.monotonic())
+        while len(self._entries) > self.maxsize:
+            _, (evicted, _) = self._entries.popitem(last=False)
+            self._evicted(evicted)
+
+    def pop(self, key: int, default=None) -> Optional[DeviceAdapter]:
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return default
+        self._evicted(entry[0])
+        return entry[0]
+
+    def _evicted(self, adapter: DeviceAdapter) -> None:
+        if self.on_evict is not None:
+            self.on_evict(adapter)
+
+
+# The event loop only keeps weak references to tasks; hold the pending close
+# tasks here so they can't be garbage-collected before the transport closes
+_CLOSE_TASKS: "set[asyncio.Task]" = set()
+
+
+def _close_adapter(adapter: DeviceAdapter) -> None:
+    """Schedule adapter.close() on the running loop (eviction callback)."""
+    try:
+        loop = asyncio.get_running_loop()
+    except RuntimeError:
+        return
+    task = loop.create_task(adapter.close())
+    _CLOSE_TASKS.add(task)
+    task.add_done_callback(_CLOSE_TASKS.discard)
+
 
 class KasaAdapter(DeviceAdapter):
-    """Adapter that uses python-kasa SmartPlug for control."""
+    """Adapter that uses a python-kasa IotPlug for control.
+
+    The IotPlug (and its protocol transport) is kept open across calls so
+    repeated commands reuse the same connection. A failed command is raised
+    as-is; DeviceManager then evicts the adapter so the next call reconnects.
+    """
+
+    # Seconds a state read from the last update() is considered fresh
+    STATE_MAX_AGE = 5.0
 
     def __init__(self, ip: str):
         self.ip = ip
         self.plug = None
+        self._last_update = 0.0
 
     async def _ensure(self):
         try:
-            from kasa import SmartPlug
-        except Exception as exc:
-            logger.error("python-kasa is required for KasaAdapter: %s", exc)
+            _require_kasa()
+        except RuntimeError:
+            logger.error("python-kasa is required for KasaAdapter")
             raise
         if not self.plug:
-            self.plug = SmartPlug(self.ip)
+            self.plug = IotPlug(self.ip)
             try:
-                await self.plug.update()
+                await self._update()
             except Exception:
-                logger.exception("Failed to update SmartPlug at %s", self.ip)
+                logger.exception("Failed to update IotPlug at %s", self.ip)
+
+    async def _update(self) -> None:
+        await self.plug.update()
+        self._last_update = time.monotonic()
+
+    async def _reconnect(self) -> None:
+        """Drop the current connection and open a fresh one."""
+        self._last_update = 0.0
+        await self.close()
+        await self._ensure()
 
     async def turn_on(self) -> None:
         await self._ensure()
         try:
             await self.plug.turn_on()
         except Exception:
+            # No inline reconnect/retry: DeviceManager evicts (and closes) this
+            # adapter on failure, so the next command starts from a fresh one
             logger.exception("KasaAdapter.turn_on() failed for %s", self.ip)
             raise
+        # Cached sys_info is stale after a state change
+        self._last_update = 0.0
 
     async def turn_off(self) -> None:
         await self._ensure()
         try:
             await self.plug.turn_off()
         except Exception:
+            # No inline reconnect/retry: DeviceManager evicts (and closes) this
+            # adapter on failure, so the next command starts from a fresh one
             logger.exception("KasaAdapter.turn_off() failed for %s", self.ip)
             raise
+        self._last_update = 0.0
 
     async def get_state(self) -> Dict:
         await self._ensure()
         try:
+            # Only poll the device when the cached state has gone stale
+            if time.monotonic() - self._last_update > self.STATE_MAX_AGE:
+                try:
+                    await self._update()
+                except Exception:
+                    logger.warning(
+                        "KasaAdapter.get_state() update failed for %s, reconnecting",
+                        self.ip,
+                    )
+                    await self._reconnect()
             # Some versions expose `.is_on` boolean after update()
             state = getattr(self.plug, "is_on", None)
             if state is None:
@@ -125,6 +286,76 @@ class KasaAdapter(DeviceAdapter):
             logger.exception("KasaAdapter.get_state() failed for %s", self.ip)
             return {"is_on": False}
 
+    async def close(self) -> None:
+        plug, self.plug = self.plug, None
+        if plug is not None:
+            try:
+                await plug.disconnect()
+            except Exception:
+                logger.debug("Ignoring error closing IotPlug at %s", self.ip)
+
+
+async def _none():
+    return None
+
+
+# Once at least one device has answered, stop listening after this many
+# seconds without a new reply instead of waiting out the full timeout
+DISCOVERY_QUIET_PERIOD = 0.5
+# Unicast probes of known devices: how many run at once, and how long each
+# may take before that device is treated as unresponsive
+PROBE_CONCURRENCY = 8
+PROBE_TIMEOUT = 1.0
+
+
+async def _discover_until_quiet(
+    timeout: float, target: Optional[str] = None, quiet: float = DISCOVERY_QUIET_PERIOD
+) -> Dict:
+    """Run Discover.discover(), returning early once replies stop arriving.
+
+    Waits up to `timeout` seconds for the first reply; after that, returns
+    as soon as `quiet` seconds pass without another device answering.
+    """
+    found = {}
+    arrived = asyncio.Event()
+
+    async def on_discovered(device):
+        found[device.host] = device
+        arrived.set()
+
+    kwargs = {"target": target} if target else {}
+    task = asyncio.ensure_future(
+        Discover.discover(
+            on_discovered=on_discovered, discovery_timeout=timeout, **kwargs
+        )
+    )
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout
+    while not task.done():
+        remaining = deadline - loop.time()
+        if remaining <= 0:
+            break
+        window = min(remaining, quiet) if found else remaining
+        arrived.clear()
+        waiter = asyncio.ensure_future(arrived.wait())
+        done, _ = await asyncio.wait(
+            {task, waiter}, timeout=window, return_when=asyncio.FIRST_COMPLETED
+        )
+        waiter.cancel()
+        if not done:
+            break
+
+    if task.done():
+        return task.result()
+    # Cancelling closes kasa's discovery transport
+    task.cancel()
+    try:
+        await task
+    except asyncio.CancelledError:
+        pass
+    logger.debug("Discovery went quiet after %d device(s)", len(found))
+    return found
+
 
 class DeviceManager:
     """
@@ -135,77 +366,155 @@ class DeviceManager:
     def __init__(self, db):
         self.db = db
         # adapter cache keyed by device id
-        self._adapter_cache: Dict[int, DeviceAdapter] = {}
+        self._adapter_cache = AdapterCache(on_evict=_close_adapter)
+        # in-flight broadcast discovery shared by concurrent scans
+        self._broadcast_task: Optional[asyncio.Future] = None
+
+    async def _db(self, fn, *args, **kwargs):
+        """Run a blocking database call in a worker thread."""
+        self.db.ensure_connection()
+        return await asyncio.to_thread(fn, *args, **kwargs)
 
     async def discover(self, timeout: int = 5) -> List[Dict]:
-        """Discover devices on the local network using python-kasa.
+        """Backwards-compatible alias for discover_new()."""
+        return await self.discover_new(timeout=timeout)
+
+    async def refresh_known(self, timeout: float = PROBE_TIMEOUT) -> Dict[int, Dict]:
+        """Probe every registered device directly (unicast) by its stored IP.
+
+        Returns a mapping of device id -> state for the devices that answered
+        and updates their status/last_seen in the database. Devices that do
+        not answer within `timeout` seconds are left untouched. At most
+        PROBE_CONCURRENCY probes are in flight at once.
+        """
+        try:
+            _require_kasa()
+        except RuntimeError:
+            logger.error("python-kasa is required for discovery")
+            raise
+
+        devices = [d for d in await self._db(self.db.list_devices) if d.get("ip")]
+        semaphore = asyncio.Semaphore(PROBE_CONCURRENCY)
+
+        async def query(ip: str) -> Optional[bool]:
+            device = await Discover.discover_single(ip, discovery_timeout=timeout)
+            if device is None:
+                return None
+            try:
+                # discover_single() returns a device that hasn't been updated;
+                # its is_on is only meaningful after a state query
+                await device.update()
+                return bool(device.is_on)
+            finally:
+                await device.disconnect()
+
+        async def probe(ip: str) -> Optional[bool]:
+            async with semaphore:
+                return await asyncio.wait_for(query(ip), timeout)
+
+        results = await asyncio.gather(
+            *(probe(d["ip"]) for d in devices), return_exceptions=True
+        )
+        now = int(time.time())
+        refreshed = {}
+        updates = []
+        for device, is_on in zip(devices, results):
+            if is_on is None or isinstance(is_on, Exception):
+                logger.info("Known device at %s did not respond: %s", device["ip"], is_on)
+                continue
+            device_id = int(device["id"])
+            state = {"is_on": is_on}
+            updates.append((device_id, "on" if is_on else "off", now))
+            refreshed[device_id] = state
+        await self.flush_status(updates)
+        return refreshed
+
+    async def discover_new(self, timeout: int = 5) -> List[Dict]:
+        """Discover new devices on the local network using python-kasa.
 
         Returns a list of discovery records: {ip, mac, model, raw}
-        Filters out devices that are already registered in the database.
+        Filters out devices that are already registered in the database;
+        use refresh_known() to reach those without a broadcast.
         Automatically detects the primary WiFi network broadcast address
         to avoid router restrictions on global broadcast.
         """
         try:
-            from kasa import Discover
-        except Exception as exc:
-            logger.error("python-kasa is required for discovery: %s", exc)
+            _require_kasa()
+        except RuntimeError:
+            logger.error("python-kasa is required for discovery")
             raise
 
+        # Check out the connection before _classify() fans out into tasks
+        self.db.ensure_connection()
         discovered = []
         try:
-            # Try to detect WiFi network broadcast address
-            target = get_broadcast_target()
-
-            # Perform discovery with or without target
-            if target:
-                results = await Discover.discover(target=target, timeout=timeout)
-            else:
-                logger.info("Using default discovery (no specific target)")
-                results = await Discover.discover(timeout=timeout)
-
-            if not results or len(results) == 0:
-                logger.info(
-                    "No devices found in initial discovery, retrying " "with default"
-                )
-                results = await Discover.discover()
-
-            logger.info(f"Raw discover results returned {len(results)} device dicts.")
-
-            for ip, info in results.items():
-                logger.debug(f"param 'info' for IP {ip} is type '{type(info)}'")
-                logger.debug(f"fields for <info> object: {dir(info)}")
-
-                # Try common locations for mac/model
-                mac = None
-                model = None
-                if isinstance(info, dict):
-                    mac = info.get("mac") or info.get("sys_info", {}).get("mac")
-                    model = info.get("model") or info.get("sys_info", {}).get("model")
-                else:
-                    try:
-                        mac = info.mac
-                        model = info.model
-                        info = info.config.to_dict()
-                    except Exception:
-                        pass
-
-                # Skip devices that are already registered (by IP or MAC)
-                existing_by_ip = self.db.get_device_by_ip(ip) if ip else None
-                existing_by_mac = self.db.get_device_by_mac(mac) if mac else None
-                if existing_by_ip or existing_by_mac:
-                    logger.info("Skipping already-registered device at %s", ip)
-                    continue
-
-                discovered.append({"ip": ip, "mac": mac, "model": model, "raw": info})
+            results = await self._broadcast(timeout)
+            logger.info("Raw discover results returned %d device dicts.", len(results))
+
+            records = await asyncio.gather(
+                *(self._classify(ip, info) for ip, info in results.items())
+            )
+            discovered = [r for r in records if r is not None]
         except Exception:
             logger.exception("Device discovery failed")
 
-        logger.debug(f"type of discovered[0]: {type(discovered[0])}")
-        logger.debug(f"type of discovered.ip: {type(discovered[0].get('ip'))}")
-        logger.debug(f"type of discovered.raw: {type(discovered[0].get('raw'))}")
+        if discovered and logger.isEnabledFor(logging.DEBUG):
+            logger.debug("type of discovered[0]: %s", type(discovered[0]))
+            logger.debug("type of discovered.ip: %s", type(discovered[0].get("ip")))
+            logger.debug("type of discovered.raw: %s", type(discovered[0].get("raw")))
 
         return discovered
 
+    async def _broadcast(self, timeout: int) -> Dict:
+        """Run one broadcast discovery, sharing it with any concurrent callers.
+
+        Overlapping scans (e.g. two users on the "Add Device" page) reuse the
+        in-flight discovery instead of each opening a socket and broadcasting.
+        """
+        task = self._broadcast_task
+        if task is None or task.done():
+            task = asyncio.ensure_future(self._run_broadcast(timeout))
+            self._broadcast_task = task
+        else:
+            logger.debug("Joining in-flight discovery broadcast")
+        return await asyncio.shield(task)
+
+    async def _run_broadcast(self, timeout: int) -> Dict:
+        # Try to detect WiFi network broadcast address
+        target = get_broadcast_target()
+
+        # Perform discovery with or without target
+        if target:
+            results = await _discover_until_quiet(timeout, target=target)
+        else:
+            logger.info("Using default discovery (no specific target)")
+            results = await _discover_until_quiet(timeout)
+
+        if not results or len(results) == 0:
+            logger.info(
+                "No devices found in initial discovery, retrying " "with default"
+            )
+            results = await _discover_until_quiet(timeout)
+        return results
+
+    async def _classify(self, ip: str, info) -> Optional[Dict]:
+        """Build a discovery record for one result, or None if already registered."""
+        # python-kasa returns initialized Device objects keyed by IP
+        mac = getattr(info, "mac", None)
+        model = getattr(info, "model", None)
+        raw = info.config.to_dict() if hasattr(info, "config") else {}
+
+        # Skip devices that are already registered (by IP or MAC)
+        existing_by_ip, existing_by_mac = await asyncio.gather(
+            self._db(self.db.get_device_by_ip, ip) if ip else _none(),
+            self._db(self.db.get_device_by_mac, mac) if mac else _none(),
+        )
+        if existing_by_ip or existing_by_mac:
+            logger.info("Skipping already-registered device at %s", ip)
+            return None
+
+        return {"ip": ip, "mac": mac, "model": model, "raw": raw}
+
     async def provision(self, discovery_record: Dict, owner_id: int, name: str) -> int:
         """Register a discovered device into the database and mark provisioned.
 
@@ -215,8 +524,14 @@ class DeviceManager:
         ip = discovery_record.get("ip")
         mac = discovery_record.get("mac")
         model = discovery_record.get("model") or "unknown"
-        device_id = self.db.add_device(
-            name=name, model=model, owner_id=owner_id, ip=ip, mac=mac, provisioned=True
+        device_id = await self._db(
+            self.db.add_device,
+            name=name,
+            model=model,
+            owner_id=owner_id,
+            ip=ip,
+            mac=mac,
+            provisioned=True,
         )
         if device_id and device_id != -1:
             logger.info(
@@ -226,47 +541,132 @@ class DeviceManager:
         logger.error(f"Failed to provision device {name} for owner {owner_id}")
         return -1
 
+    async def provision_many(
+        self, registrations: List[Tuple[Dict, str]], owner_id: int
+    ) -> List[int]:
+        """Register several discovered devices in a single transaction.
+
+        registrations is a list of (discovery_record, name) pairs.
+        Returns the new device ids (in order), or an empty list on failure.
+        """
+        records = [
+            (
+                name,
+                record.get("model") or "unknown",
+                owner_id,
+                record.get("ip"),
+                record.get("mac"),
+                True,
+            )
+            for record, name in registrations
+        ]
+        device_ids = await self._db(self.db.add_devices_bulk, records)
+        if device_ids:
+            logger.info(
+                "Provisioned %d devices for owner %s", len(device_ids), owner_id
+            )
+        else:
+            logger.error(
+                "Failed to provision %d devices for owner %s", len(records), owner_id
+            )
+        return device_ids
+
     def get_device(self, device_id: int) -> Optional[dict]:
         return self.db.get_device_by_id(device_id)
 
     def _adapter_for_device(self, device: dict) -> DeviceAdapter:
         device_id = int(device["id"])
-        if device_id in self._adapter_cache:
-            return self._adapter_cache[device_id]
+        adapter = self._adapter_cache.get(device_id)
+        if adapter is not None:
+            return adapter
         ip = device.get("ip")
         if not ip:
             raise RuntimeError("Device has no IP address")
         adapter = KasaAdapter(ip)
-        self._adapter_cache[device_id] = adapter
+        self._adapter_cache.set(device_id, adapter)
         return adapter
 
     async def turn_on(self, device_id: int) -> None:
-        device = self.get_device(device_id)
-        if not device:
-            raise KeyError("Device not found")
-        adapter = self._adapter_for_device(device)
-        await adapter.turn_on()
-        # update DB status
-        now = datetime.utcnow().isoformat()
-        self.db.update_device_status(device_id, "on", last_seen=now)
+        await self._set_power(device_id, on=True)
 
     async def turn_off(self, device_id: int) -> None:
-        device = self.get_device(device_id)
+        await self._set_power(device_id, on=False)
+
+    async def _set_power(self, device_id: int, on: bool) -> None:
+        device = await self._db(self.db.get_device_by_id, device_id)
         if not device:
             raise KeyError("Device not found")
         adapter = self._adapter_for_device(device)
-        await adapter.turn_off()
-        now = datetime.utcnow().isoformat()
-        self.db.update_device_status(device_id, "off", last_seen=now)
+        status = "on" if on else "off"
+        now = int(time.time())
+        # Write the target state while the command is in flight; both are
+        # awaited to completion so the compensating write below cannot race it
+        result, _ = await asyncio.gather(
+            adapter.turn_on() if on else adapter.turn_off(),
+            self._db(self.db.update_device_status, device_id, status, last_seen=now),
+            return_exceptions=True,
+        )
+        if isinstance(result, Exception):
+            # Drop the adapter so the next call starts from a fresh connection
+            self._adapter_cache.pop(device_id)
+            # Put back the pre-command last_seen the optimistic write replaced;
+            # the batch write stores it as-is, including None
+            await self.flush_status([(device_id, "unknown", device.get("last_seen"))])
+            raise result
 
     async def get_state(self, device_id: int) -> Dict:
-        device = self.get_device(device_id)
+        device = await self._db(self.db.get_device_by_id, device_id)
         if not device:
             raise KeyError("Device not found")
         adapter = self._adapter_for_device(device)
         state = await adapter.get_state()
-        now = datetime.utcnow().isoformat()
-        self.db.update_device_status(
-            device_id, "on" if state.get("is_on") else "off", last_seen=now
+        now = int(time.time())
+        await self._db(
+            self.db.update_device_status,
+            device_id,
+            "on" if state.get("is_on") else "off",
+            last_seen=now,
         )
         return state
+
+    async def get_states(self, device_ids: List[int]) -> Dict[int, Dict]:
+        """Fetch the state of several devices concurrently.
+
+        Returns a mapping of device id -> state; unknown ids are skipped, and
+        devices that can't be queried (e.g. no IP) are marked "unknown" and left
+        out rather than failing the whole batch.
+        """
+        # Check out the connection before the lookups fan out into tasks
+        self.db.ensure_connection()
+        devices = await asyncio.gather(
+            *(self._db(self.db.get_device_by_id, device_id) for device_id in device_ids)
+        )
+        devices = [d for d in devices if d]
+        states = await asyncio.gather(
+            *(self._query_state(d) for d in devices), return_exceptions=True
+        )
+        now = int(time.time())
+        result = {}
+        updates = []
+        for device, state in zip(devices, states):
+            device_id = int(device["id"])
+            if isinstance(state, Exception):
+                logger.warning(
+                    "Could not query state of device %s: %s", device_id, state
+                )
+                updates.append((device_id, "unknown", device.get("last_seen")))
+                continue
+            updates.append((device_id, "on" if state.get("is_on") else "off", now))
+            result[device_id] = state
+        await self.flush_status(updates)
+        return result
+
+    async def _query_state(self, device: dict) -> Dict:
+        # Coroutine wrapper so a missing IP surfaces inside gather, per device
+        return await self._adapter_for_device(device).get_state()
+
+    async def flush_status(self, updates: List[tuple]) -> bool:
+        """Write (device_id, status, last_seen) tuples in one DB transaction."""
+        if not updates:
+            return True
+        return await self._db(self.db.update_device_statuses, updates)
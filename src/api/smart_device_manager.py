@@ -27,12 +27,22 @@ from kasa import Device, DeviceConfig, Discover
 import subprocess
 import json
 import logging
+import os
 import pathlib
 import pprint
+import time
 import traceback
-from typing import Optional
+from typing import Dict, Optional, Tuple
 
-logger = logging.getLogger("onelight-app")
+try:
+    import orjson
+    _json_loads = orjson.loads
+except ImportError:
+    _json_loads = json.loads
+
+from constants import ONELIGHT_LOG_NAME
+
+logger = logging.getLogger(ONELIGHT_LOG_NAME)
 
 DEFAULT_CONFIG_PATH = pathlib.Path(__file__).parents[2] / ".ignore" / "config.json"
 DEFAULT_BROADCAST = "255.255.255.255"
@@ -45,8 +55,22 @@ OFF = "OFF"
 CODE_200 = "200"
 CODE_400 = "400"
 
+# Seconds to wait for a cached device to answer before falling back to discovery
+CACHE_PROBE_TIMEOUT = 0.4
+
+# Last known on/off state per host: {host: (is_on, monotonic timestamp)}
+# - reads within STATE_MAX_AGE_SECONDS of a write/poll skip device.update()
+# - repeated writes of the same state within WRITE_DEBOUNCE_SECONDS are dropped
+STATE_MAX_AGE_SECONDS = 2.0
+WRITE_DEBOUNCE_SECONDS = 1.0
+_LAST_STATE: Dict[str, Tuple[bool, float]] = {}
+
+# Parsed config.json contents keyed by path: {path: {"mtime": ..., "data": ...}}
+_CONFIG_CACHE = {}
+
 # Lightweight device cache
-# - a device type (e.g., "hs100") can have 2+ devices listed by {ip:config}
+# - a device type (e.g., "hs100") can have 2+ devices listed by {ip:Device}
+# - the live Device is kept so its open connection is reused across calls
 device_cache = {
     HS100: {
     }
@@ -60,10 +84,38 @@ async def get_hs100_device() -> Optional[Device]:
     For now, this is not scalable (2+ HS100s) and will need expansion later.
     """
 
-    # Check device cache
-    if len(device_cache[HS100]) != 0:
-        device = await Device.connect(host=list(device_cache[HS100].keys())[0])
-        if isinstance(device, Device):
+    # Check device cache - probe each cached device with a quick update()
+    for ip, device in list(device_cache[HS100].items()):
+        if not isinstance(device, Device):
+            continue
+        try:
+            await asyncio.wait_for(device.update(), timeout=CACHE_PROBE_TIMEOUT)
+        except Exception:
+            logger.info(f"Cached device at {ip} did not respond, invalidating")
+            await invalidate_device_cache(ip)
+            continue
+        _record_state(device.host, device.is_on)
+        return device
+
+    # Check for device via hard-set endpoint IP (unicast before broadcast)
+    try_host_ip = get_hs100_uncertain_ip()
+    logger.info(f"Fallback: Using host IP {try_host_ip}")
+    if try_host_ip is not None:
+        try:
+            device = await Device.connect(host=try_host_ip)
+        except Exception:
+            logger.warning(f"Could not connect to host IP {try_host_ip}")
+            device = None
+        if device is not None and is_hs100_device(device):
+            conf_ = pprint.pformat(
+                device.config.to_dict(),
+                indent=4,
+                sort_dicts=False
+            )
+            logger.info(
+                f"config:\n{conf_}"
+            )
+            update_device_cache(device, is_hs100=True)
             return device
 
     # Check for device via broadcast
@@ -87,23 +139,6 @@ async def get_hs100_device() -> Optional[Device]:
                 update_device_cache(device, is_hs100=True)
                 return device
 
-    # Check for device via hard-set endpoint IP
-    try_host_ip = get_hs100_uncertain_ip()
-    logger.info(f"Fallback: Using host IP {try_host_ip}")
-    if try_host_ip is not None:
-        device = await Device.connect(host=try_host_ip)
-        if is_hs100_device(device):
-            conf_ = pprint.pformat(
-                device.config.to_dict(),
-                indent=4,
-                sort_dicts=False
-            )
-            logger.info(
-                f"config:\n{conf_}"
-            )
-            update_device_cache(device, is_hs100=True)
-            return device
-
     return None
 
 
@@ -121,14 +156,21 @@ async def turn_on_hs100(device: Optional[Device] = None):
     if device is None:
         device = await get_hs100_device()
     if isinstance(device, Device):
+        # Skip the network call if we switched it on a moment ago
+        if _recent_state(device.host, WRITE_DEBOUNCE_SECONDS) is True:
+            return
         await device.turn_on()
+        _record_state(device.host, True)
 
 
 async def turn_off_hs100(device: Optional[Device] = None):
     if device is None:
         device = await get_hs100_device()
     if isinstance(device, Device):
+        if _recent_state(device.host, WRITE_DEBOUNCE_SECONDS) is False:
+            return
         await device.turn_off()
+        _record_state(device.host, False)
 
 
 async def get_hs100_on_state(device: Optional[Device] = None):
@@ -136,15 +178,61 @@ async def get_hs100_on_state(device: Optional[Device] = None):
         device = await get_hs100_device()
     s = f"{HS100}: "
     if isinstance(device, Device):
-        return f"{s}ON" if device.is_on else f"{s}OFF"
+        is_on = _recent_state(device.host, STATE_MAX_AGE_SECONDS)
+        if is_on is None:
+            # Cached devices hold the state from their last update; refresh it
+            await device.update()
+            is_on = device.is_on
+            _record_state(device.host, is_on)
+        return f"{s}ON" if is_on else f"{s}OFF"
     return f"{s}UNKNOWN STATE"
 
 
+def _record_state(host: str, is_on: bool):
+    _LAST_STATE[host] = (is_on, time.monotonic())
+
+
+def _recent_state(host: str, max_age: float) -> Optional[bool]:
+    """
+    Return the last known on/off state for <host> if it was recorded within
+    <max_age> seconds, otherwise None.
+    """
+    entry = _LAST_STATE.get(host)
+    if entry is None or time.monotonic() - entry[1] >= max_age:
+        return None
+    return entry[0]
+
+
 def load_config(json_config_path: pathlib.Path = DEFAULT_CONFIG_PATH):
+    """
+    Return the parsed JSON config, re-reading the file only when its
+    modification time has changed since the last call.
+
+    A missing file yields an empty config, which is cached (and warned
+    about) once until the file appears.
+    """
     path = pathlib.Path(json_config_path)
-    with open(path, 'r') as config:
+    try:
+        mtime = os.stat(path).st_mtime
+    except FileNotFoundError:
+        mtime = None
+    cached = _CONFIG_CACHE.get(path)
+    if cached is not None and cached["mtime"] == mtime:
+        return cached["data"]
+    if mtime is None:
+        logger.warning(f"Config file '{path}' not found, using empty JSON config...")
+        data = {}
+    else:
+        data = _read_config(path)
+    _CONFIG_CACHE[path] = {"mtime": mtime, "data": data}
+    return data
+
+
+def _read_config(path: pathlib.Path):
+    # orjson (when installed) parses bytes directly and is faster than json
+    with open(path, 'rb') as config:
         try:
-            return json.load(config)
+            return _json_loads(config.read())
         except Exception:
             logger.exception("Exception in load_config()...")
     logger.warning("Returning empty JSON config...")
@@ -172,6 +260,16 @@ def is_hs100_device(device: Device):
     return device.device_id == get_hs100_mac()
 
 
+async def invalidate_device_cache(ip: str, model: str = HS100):
+    device = device_cache[model].pop(ip, None)
+    _LAST_STATE.pop(ip, None)
+    if isinstance(device, Device):
+        try:
+            await device.disconnect()
+        except Exception:
+            logger.debug(f"Ignoring error closing cached device at {ip}")
+
+
 def update_device_cache(device: Device, is_hs100: bool = False):
     model = HS100 if is_hs100 else UNKNOWN
-    device_cache[model][device.host] = device.config.to_dict()
+    device_cache[model][device.host] = device
@@ -4,9 +4,13 @@ Project OneLight.
 Application entry point.
 """
 
+import atexit
 import logging
+import queue
 import sys
-from logging.handlers import RotatingFileHandler
+from datetime import datetime
+from functools import wraps
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
 from markupsafe import escape
 from secrets import compare_digest
 from typing import Optional
@@ -21,8 +25,9 @@ from quart import (
     request,
     url_for,
     session,
+    g,
 )
-from quart import abort, jsonify
+from quart import Response, abort, jsonify
 from quart_auth import (
     QuartAuth,
     AuthUser,
@@ -70,24 +75,79 @@ HOME = "home"
 
 POST = "POST"
 GET = "GET"
-METHODS_GET_POST = {GET, POST}
+METHODS_GET_POST = (GET, POST)
+TEXT_HTML = "text/html"
 
-logger = logging.getLogger(ONELIGHT_LOG_NAME)
-logger.setLevel(logging.DEBUG)
-
-log_fmt = "%(asctime)s - %(name)s - [%(levelname)s] - %(message)s"
-log_handler = RotatingFileHandler("onelight-app.log", maxBytes=80 * KB, backupCount=4)
-log_handler.setLevel(logging.DEBUG)
-log_handler.setFormatter(logging.Formatter(log_fmt))
+# Pre-encoded bodies for the legacy control routes. A fresh Response is still
+# built per request since after-request hooks (session/auth cookies) mutate it.
+TEXT_PLAIN = "text/plain"
+LIGHT_ON_BODY = "Light turned on!".encode("utf-8")
+LIGHT_OFF_BODY = "Light turned off!".encode("utf-8")
 
-# Console logging
-console_handler = logging.StreamHandler()
-console_handler.setLevel(logging.DEBUG)
-console_handler.setFormatter(logging.Formatter(log_fmt))
+logger = logging.getLogger(ONELIGHT_LOG_NAME)
 
-# Add log handlers
-logger.addHandler(log_handler)
-logger.addHandler(console_handler)
+# Background thread that drains the log queue into the file/console handlers
+_log_listener: Optional[QueueListener] = None
+_log_queue_handler: Optional[QueueHandler] = None
+
+
+def _configure_logging() -> None:
+    """
+    Attach logging handlers once, even if this module is re-imported.
+
+    The logger only gets a QueueHandler; file and console writes (including
+    file rotation) happen on the QueueListener thread, off the event loop.
+    """
+    global _log_listener, _log_queue_handler
+    if logger.handlers:
+        return
+    logger.setLevel(logging.DEBUG)
+
+    log_fmt = "%(asctime)s - %(name)s - [%(levelname)s] - %(message)s"
+    log_handler = RotatingFileHandler(
+        f"{ONELIGHT_LOG_NAME}.log", maxBytes=80 * KB, backupCount=4
+    )
+    log_handler.setLevel(logging.DEBUG)
+    log_handler.setFormatter(logging.Formatter(log_fmt))
+
+    # Console logging
+    console_handler = logging.StreamHandler()
+    console_handler.setLevel(logging.DEBUG)
+    console_handler.setFormatter(logging.Formatter(log_fmt))
+
+    # Add log handlers
+    # Unbounded SimpleQueue: put() never blocks and skips Queue's task tracking
+    log_queue = queue.SimpleQueue()
+    _log_queue_handler = QueueHandler(log_queue)
+    logger.addHandler(_log_queue_handler)
+    _log_listener = QueueListener(
+        log_queue, log_handler, console_handler, respect_handler_level=True
+    )
+    _log_listener.start()
+    atexit.register(_stop_logging)
+
+
+def _stop_logging() -> None:
+    """
+    Flush queued log records and stop the listener thread.
+
+    The listener's handlers are attached to the logger directly before it
+    stops, so records logged after shutdown are still written, not queued
+    for a thread that no longer drains them.
+    """
+    global _log_listener, _log_queue_handler
+    if _log_listener is None:
+        return
+    # Swap handlers first; stop() then drains whatever is already queued
+    logger.removeHandler(_log_queue_handler)
+    for handler in _log_listener.handlers:
+        logger.addHandler(handler)
+    _log_listener.stop()
+    _log_listener = None
+    _log_queue_handler = None
+
+
+_configure_logging()
 
 
 # Add global config classes
@@ -121,22 +181,61 @@ auth_manager = QuartAuth(app)
 
 # Database setup
 db = OneLightDB(app, overwrite_if_exists=False)
-logger.debug(f"DB config lives at: {app.config.get(DATABASE, '')}")
+logger.debug("DB config lives at: %s", app.config.get(DATABASE, ""))
 
 # Device manager instance (uses new device_manager module)
 device_manager = DeviceManager(db)
 
 
+# Resolved URLs for the parameterless endpoints we redirect to. Filled on
+# first use since url_for() needs a request context without SERVER_NAME.
+_REDIRECT_URLS = {}
+
+
+def _url_for(endpoint: str) -> str:
+    url = _REDIRECT_URLS.get(endpoint)
+    if url is None:
+        url = _REDIRECT_URLS[endpoint] = url_for(endpoint)
+    return url
+
+
+# Rendered bodies of pages with no per-user content (landing, login, signup).
+# Skipped in debug so template edits still show up without a restart.
+_STATIC_PAGES = {}
+
+
+async def _render_static_page(template: str):
+    if app.debug or "_flashes" in session:
+        return await render_template(template)
+    body = _STATIC_PAGES.get(template)
+    if body is None:
+        body = _STATIC_PAGES[template] = (await render_template(template)).encode()
+    return Response(body, mimetype=TEXT_HTML)
+
+
+@app.after_serving
+async def stop_logging():
+    _stop_logging()
+
+
+@app.template_filter("from_epoch")
+def from_epoch(value) -> str:
+    # last_seen is stored as unix epoch seconds
+    if not value:
+        return "never"
+    return datetime.fromtimestamp(int(value)).strftime("%Y-%m-%d %H:%M:%S")
+
+
 @app.route("/")
 async def index():
     user_is_authenticated = await current_user.is_authenticated
-    logger.debug(f"Current user authenticated? {user_is_authenticated}")
+    logger.debug("Current user authenticated? %s", user_is_authenticated)
 
     # If already logged in, redirect to home
     if user_is_authenticated:
-        return redirect(url_for(HOME))
+        return redirect(_url_for(HOME))
     # Otherwise show landing page with signup primary and a login option
-    return await render_template("landing.html")
+    return await _render_static_page("landing.html")
 
 
 @app.route("/signup", methods=METHODS_GET_POST)
@@ -151,14 +250,14 @@ async def signup():
         if signup_status_code != OK_ZERO:
             await flash(f"Error: {info}. Please try again")
             # return await render_template(SIGNUP_HTML, error=info)
-            return redirect(url_for(SIGNUP))
+            return redirect(_url_for(SIGNUP))
         else:
             await flash(
                 f"Successfully registered {data.get(USERNAME_KEY, 'Unknown')}, proceeding to login"
             )
-            return redirect(url_for(LOGIN))
+            return redirect(_url_for(LOGIN))
 
-    return await render_template(SIGNUP_HTML)
+    return await _render_static_page(SIGNUP_HTML)
 
     # Maybe:
     # - make this the default landing page
@@ -177,19 +276,15 @@ async def login():
         if attempted_login_status == 0:
             # If login success, bring customer to home page
             # Bind the authenticated session to the DB user id
-            try:
-                user_id = int(info)
-            except Exception:
-                user_id = info
-            login_user(AuthUser(str(user_id)))
-            logger.info(f"User {user_id} logged in")
-            return redirect(url_for(HOME))
+            login_user(AuthUser(info))
+            logger.info("User %s logged in", info)
+            return redirect(_url_for(HOME))
         else:
             # If login fail, redirect to login page
             logger.info(info)
             return await render_template(LOGIN_HTML, error=info)
 
-    return await render_template(LOGIN_HTML)  # TODO: Generate a better login page
+    return await _render_static_page(LOGIN_HTML)  # TODO: Generate a better login page
 
 
 @app.route("/home")
@@ -202,29 +297,41 @@ async def home():
 @app.route("/logout")
 async def logout():
     logout_user()
-    return redirect(url_for(INDEX))
+    return redirect(_url_for(INDEX))
 
 
 @app.route("/devices")
 @login_required
 async def my_devices():
     # List devices for current user
-    try:
-        owner_id = int(current_user.auth_id)
-    except Exception:
-        owner_id = current_user.auth_id
-    devices = db.get_devices_for_user(owner_id)
+    devices = db.get_devices_for_user(_current_owner_id())
     # Render devices dashboard (template to be created)
     return await render_template("devices.html", devices=devices)
 
 
-def _ensure_device_owner(device_id: int, owner_id: int):
-    device = db.get_device_by_id(device_id)
-    if not device:
-        abort(404, "Device not found")
-    if int(device.get("owner_id")) != int(owner_id):
-        abort(403, "Forbidden")
-    return device
+def _current_owner_id() -> int:
+    """Return the logged-in user's id as an int, cast once per request."""
+    owner_id = g.get("owner_id")
+    if owner_id is None:
+        owner_id = g.owner_id = int(current_user.auth_id)
+    return owner_id
+
+
+def requires_device_ownership(handler):
+    """Inject the current user's `device`, or 404 if they don't own it.
+
+    Devices owned by someone else also get a 404, so a probe can't tell
+    them apart from ids that don't exist.
+    """
+
+    @wraps(handler)
+    async def wrapper(device_id: int, **kwargs):
+        device = db.get_device_for_owner(device_id, _current_owner_id())
+        if device is None:
+            abort(404, "Device not found")
+        return await handler(device_id=device_id, device=device, **kwargs)
+
+    return wrapper
 
 
 @app.route("/devices/add")
@@ -239,7 +346,7 @@ async def devices_scan():
     # Trigger network discovery via DeviceManager
     data = None
     try:
-        discovered = await device_manager.discover(timeout=5)
+        discovered = await device_manager.discover_new(timeout=5)
         return jsonify({"candidates": discovered})
     except Exception as exc:
         logger.exception("Error during device discovery")
@@ -249,20 +356,30 @@ async def devices_scan():
 @app.route("/devices/register", methods={POST})
 @login_required
 async def devices_register():
-    # Accept JSON body or form data
-    payload = await request.get_json(silent=True)
-    if not payload:
+    # Accept JSON body or form data; only parse the body the way it was sent
+    if request.is_json:
+        payload = await request.get_json(silent=True) or {}
+    else:
         form = await request.form
-        payload = {k: form.get(k) for k in form.keys()}
+        payload = form.to_dict()
 
-    name = payload.get("name") or payload.get("device_name") or "Unnamed Device"
-    owner_id = int(current_user.auth_id)
-    # discovery_record may be included directly or built from fields
-    discovery_record = payload.get("discovery") or {
-        "ip": payload.get("ip"),
-        "mac": payload.get("mac"),
-        "model": payload.get("model"),
-    }
+    owner_id = _current_owner_id()
+
+    # Several discovery records at once are provisioned in one transaction
+    entries = payload.get("devices")
+    if isinstance(entries, list) and entries:
+        try:
+            device_ids = await device_manager.provision_many(
+                [_registration(entry) for entry in entries], owner_id
+            )
+            if device_ids:
+                return jsonify({"device_ids": device_ids})
+            return jsonify({"error": "Provision failed"}), 500
+        except Exception as exc:
+            logger.exception("Error provisioning devices")
+            return jsonify({"error": str(exc)}), 500
+
+    discovery_record, name = _registration(payload)
     try:
         device_id = await device_manager.provision(discovery_record, owner_id, name)
         if device_id and device_id != -1:
@@ -273,19 +390,29 @@ async def devices_register():
         return jsonify({"error": str(exc)}), 500
 
 
+def _registration(payload: dict):
+    """Return (discovery_record, name) for one device registration payload."""
+    name = payload.get("name") or payload.get("device_name") or "Unnamed Device"
+    # discovery_record may be included directly or built from fields
+    discovery_record = payload.get("discovery") or {
+        "ip": payload.get("ip"),
+        "mac": payload.get("mac"),
+        "model": payload.get("model"),
+    }
+    return discovery_record, name
+
+
 @app.route("/devices/<int:device_id>")
 @login_required
-async def device_detail(device_id: int):
-    owner_id = int(current_user.auth_id)
-    device = _ensure_device_owner(device_id, owner_id)
+@requires_device_ownership
+async def device_detail(device_id: int, device: dict):
     return await render_template("device_detail.html", device=device)
 
 
 @app.route("/devices/<int:device_id>/on", methods={POST})
 @login_required
-async def device_turn_on(device_id: int):
-    owner_id = int(current_user.auth_id)
-    _ensure_device_owner(device_id, owner_id)
+@requires_device_ownership
+async def device_turn_on(device_id: int, device: dict):
     try:
         await device_manager.turn_on(device_id)
         return jsonify({"status": "ok"})
@@ -296,9 +423,8 @@ async def device_turn_on(device_id: int):
 
 @app.route("/devices/<int:device_id>/off", methods={POST})
 @login_required
-async def device_turn_off(device_id: int):
-    owner_id = int(current_user.auth_id)
-    _ensure_device_owner(device_id, owner_id)
+@requires_device_ownership
+async def device_turn_off(device_id: int, device: dict):
     try:
         await device_manager.turn_off(device_id)
         return jsonify({"status": "ok"})
@@ -314,13 +440,13 @@ async def device_turn_off(device_id: int):
 @app.route("/on")
 async def turn_on():
     await turn_on_hs100()
-    return "Light turned on!"
+    return Response(LIGHT_ON_BODY, mimetype=TEXT_PLAIN)
 
 
 @app.route("/off")
 async def turn_off():
     await turn_off_hs100()
-    return "Light turned off!"
+    return Response(LIGHT_OFF_BODY, mimetype=TEXT_PLAIN)
 
 
 @app.route("/hs100_status")
@@ -16,11 +16,16 @@ TABLE: users
 """
 
 import logging
+import queue
+import threading
+import time
+from collections import OrderedDict
+from contextvars import ContextVar
 from pathlib import Path
 from sqlite3 import dbapi2 as sqlite3
-from typing import Optional
+from typing import Dict, Iterable, List, Optional, Tuple
 
-from quart import Quart, g
+from quart import Quart
 
 from constants import ONELIGHT_LOG_NAME
 
@@ -34,14 +39,97 @@ INIT_SCHEMA_PATH = "onelight_init_schema.sql"
 SQLITE_DB = "sqlite_db"
 USERS_TABLE = "users"
 DEVICES_TABLE = "devices"
+POOL_SIZE = 8
+DEVICE_UPDATABLE_FIELDS = frozenset(
+    {"name", "model", "ip", "mac", "status", "last_seen", "provisioned"}
+)
+
+# Indexes from the init schema, re-applied to DB files created before they
+# were added (the schema script only runs for new databases)
+SCHEMA_INDEXES = (
+    "CREATE INDEX IF NOT EXISTS idx_devices_owner ON devices(owner_id)",
+    "CREATE INDEX IF NOT EXISTS idx_devices_ip ON devices(ip)",
+    "CREATE INDEX IF NOT EXISTS idx_devices_mac ON devices(mac)",
+)
+
+# Mutable slot holding the connection checked out by the current request.
+# Child tasks (asyncio.gather) and worker threads (asyncio.to_thread) run in
+# copies of the context; because the slot is shared rather than re-set, the
+# connection they check out is still the one _release_db returns to the pool.
+_db_cv: ContextVar[Optional[Dict[str, sqlite3.Connection]]] = ContextVar(
+    "onelight_sqlite_db", default=None
+)
+
+# Applied once to every new pooled connection
+CONNECTION_PRAGMAS = (
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA cache_size=-20000",
+)
+
+
+_MISSING = object()
+
+
+class _LookupCache:
+    """Small thread-safe LRU cache whose entries expire after `ttl` seconds."""
+
+    def __init__(self, maxsize: int = 4096, ttl: float = 30.0):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=_MISSING):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return default
+            value, expires = entry
+            if time.monotonic() >= expires:
+                del self._entries[key]
+                return default
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value) -> None:
+        with self._lock:
+            self._entries[key] = (value, time.monotonic() + self.ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
 
 
 class OneLightDB:
+    # UPDATE statements keyed by their (sorted) column tuple; keeping the SQL
+    # text identical per column set lets sqlite's statement cache reuse plans
+    _update_sql_cache: Dict[Tuple[str, ...], str] = {}
+
     def __init__(self, app: Quart, overwrite_if_exists: bool = False):
         self.app = app
         self.root = self.app.root_path
         app.config.update({DATABASE: Path(self.root) / ONELIGHT_DB_DB})
 
+        # Signup validation checks the same candidates repeatedly
+        self._username_cache = _LookupCache()
+        self._email_cache = _LookupCache()
+        # Whether any pre-argon2 (bcrypt) password hashes are still stored
+        self._legacy_hashes: Optional[bool] = None
+
+        # Device rows by id; mutators below invalidate the affected entries
+        self._device_cache: Dict[int, dict] = {}
+        self._user_devices_cache: Dict[int, List[dict]] = {}
+        self._device_generation = 0
+        self._device_lock = threading.Lock()
+
+        # Idle connections reused across requests (most recently used first)
+        self._pool: "queue.LifoQueue[sqlite3.Connection]" = queue.LifoQueue(
+            maxsize=POOL_SIZE
+        )
+        self._slot_lock = threading.Lock()
+        app.before_request(self._bind_db_slot)
+        app.teardown_appcontext(self._release_db)
+
         self.init_db(overwrite_if_exists=overwrite_if_exists)
 
     def init_db(self, overwrite_if_exists: bool = False) -> None:
@@ -52,39 +140,116 @@ class OneLightDB:
             db.commit()
             logger.debug("Database initialized")
             return
-        logger.debug("Database not initialized")
+        db = self._connect_db()
+        try:
+            for stmt in SCHEMA_INDEXES:
+                db.execute(stmt)
+            db.commit()
+        finally:
+            db.close()
+        logger.debug("Database not initialized (existing file, indexes ensured)")
 
     def db_file_exists(self) -> bool:
         db_file = self.app.config[DATABASE]
         if Path(db_file).exists():
-            logger.debug(f"DB file exists ('{db_file}')")
+            logger.debug("DB file exists ('%s')", db_file)
             return True
-        logger.debug(f"DB file does not exist ('{db_file}')")
+        logger.debug("DB file does not exist ('%s')", db_file)
         return False
 
     def _connect_db(self):
-        engine = sqlite3.connect(self.app.config[DATABASE])
+        # DeviceManager runs queries through worker threads (asyncio.to_thread),
+        # so the connection may be used from a thread other than its creator
+        engine = sqlite3.connect(self.app.config[DATABASE], check_same_thread=False)
         engine.row_factory = sqlite3.Row
         return engine
 
+    async def _bind_db_slot(self) -> None:
+        # Async so Quart runs it in the request's own context, not a thread
+        _db_cv.set({})
+
+    def _db_slot(self) -> Dict[str, sqlite3.Connection]:
+        slot = _db_cv.get()
+        if slot is None:
+            # Outside a request (startup, tests): bind one to this context
+            slot = {}
+            _db_cv.set(slot)
+        return slot
+
     def _get_db(self):
-        if not hasattr(g, SQLITE_DB):
-            g.sqlite_db = self._connect_db()
-        return g.sqlite_db
+        slot = self._db_slot()
+        engine = slot.get(SQLITE_DB)
+        if engine is None:
+            # Worker threads may race to fill the same slot
+            with self._slot_lock:
+                engine = slot.get(SQLITE_DB)
+                if engine is None:
+                    engine = slot[SQLITE_DB] = self._acquire_db()
+        return engine
+
+    def ensure_connection(self) -> None:
+        """Check out this context's connection before fanning work out.
+
+        Inside a request the slot is already shared with child tasks and
+        threads. Outside one, a slot first bound in a child task or worker
+        thread would be lost with that copied context, so callers bind it
+        (and check out the connection) up front.
+        """
+        self._get_db()
+
+    def _acquire_db(self):
+        """Take an idle pooled connection, or open (and configure) a new one."""
+        try:
+            return self._pool.get_nowait()
+        except queue.Empty:
+            pass
+        engine = self._connect_db()
+        for pragma in CONNECTION_PRAGMAS:
+            engine.execute(pragma)
+        return engine
+
+    def _release_db(self, exc: Optional[BaseException] = None) -> None:
+        """Return the context's connection to the pool (app teardown hook)."""
+        slot = _db_cv.get()
+        if slot is None:
+            return
+        _db_cv.set(None)
+        engine = slot.pop(SQLITE_DB, None)
+        if engine is None:
+            return
+        try:
+            if engine.in_transaction:
+                engine.rollback()
+            self._pool.put_nowait(engine)
+        except queue.Full:
+            engine.close()
+        except Exception:
+            logger.exception("Discarding broken pooled connection")
+            engine.close()
 
     def username_in_use(self, username: str) -> bool:
+        cached = self._username_cache.get(username)
+        if cached is not _MISSING:
+            return cached
         db = self._get_db()
         query = "SELECT COUNT(*) FROM users WHERE username = ?"
         cur = db.execute(query, (username,))
         res = cur.fetchone()
-        return res[0] > 0
+        in_use = res[0] > 0
+        self._username_cache.set(username, in_use)
+        return in_use
 
     def email_in_use(self, email: str) -> bool:
+        cached = self._email_cache.get(email)
+        if cached is not _MISSING:
+            return cached
         db = self._get_db()
         query = "SELECT COUNT(*) FROM users WHERE email = ?"
         cur = db.execute(query, (email,))
         res = cur.fetchone()
-        return res[0] > 0
+        in_use = res[0] > 0
+        self._email_cache.set(email, in_use)
+        return in_use
 
     def fetch_password_hash_for_username(self, username: str) -> Optional[str]:
         db = self._get_db()
@@ -95,6 +260,16 @@ class OneLightDB:
             return None
         return res[0]
 
+    def fetch_login_record(self, username: str) -> Optional[dict]:
+        """Return {id, password_hash} for given username, or None if not found."""
+        db = self._get_db()
+        query = "SELECT id, password_hash FROM users WHERE username = ? LIMIT 1"
+        cur = db.execute(query, (username,))
+        res = cur.fetchone()
+        if not res:
+            return None
+        return dict(res)
+
     def fetch_user_by_username(self, username: str) -> Optional[dict]:
         """Return user record as a dict for given username, or None if not found."""
         db = self._get_db()
@@ -121,11 +296,39 @@ class OneLightDB:
             )
             cur.execute(stmt, (username, email, hashed_password_str))
             db.commit()
+            self._username_cache.set(username, True)
+            self._email_cache.set(email, True)
             return 0
         except Exception:
             logger.exception("Exception while adding new user account!")
             return -1
 
+    def legacy_password_hashes_remain(self) -> bool:
+        """True while any user still has a bcrypt password hash."""
+        # New and upgraded hashes are argon2, so once False it stays False
+        if self._legacy_hashes is None:
+            db = self._get_db()
+            query = "SELECT EXISTS(SELECT 1 FROM users WHERE password_hash LIKE '$2%')"
+            self._legacy_hashes = bool(db.execute(query).fetchone()[0])
+        return self._legacy_hashes
+
+    def update_password_hash(self, user_id: int, password_hash: str) -> bool:
+        """Replace a user's stored password hash. Returns True on success."""
+        try:
+            db = self._get_db()
+            db.execute(
+                f"UPDATE {USERS_TABLE} SET password_hash = ? WHERE id = ?",
+                (password_hash, user_id),
+            )
+            db.commit()
+            if self._legacy_hashes:
+                # Re-check on next login; this may have been the last one
+                self._legacy_hashes = None
+            return True
+        except Exception:
+            logger.exception("Exception while updating password hash!")
+            return False
+
     def add_smart_device(self, name: str, model: str, owner: str) -> int:
         """
         Add new smart device (each device must only have one owner)
@@ -168,27 +371,124 @@ class OneLightDB:
             stmt = "INSERT INTO devices (name, model, owner_id, ip, mac, provisioned) VALUES (?, ?, ?, ?, ?, ?)"
             cur.execute(stmt, (name, model, owner_id, ip, mac, int(bool(provisioned))))
             db.commit()
+            self._invalidate_devices(cur.lastrowid, owner_id=owner_id)
             return cur.lastrowid
         except Exception:
             logger.exception("Exception while adding device to devices table")
             return -1
 
+    def add_devices_bulk(
+        self, records: Iterable[Tuple[str, str, int, Optional[str], Optional[str], bool]]
+    ) -> List[int]:
+        """Insert many devices in one transaction and return their new ids.
+
+        `records` is an iterable of (name, model, owner_id, ip, mac, provisioned)
+        tuples. Returns an empty list on error.
+        """
+        params = [
+            (name, model, owner_id, ip, mac, int(bool(provisioned)))
+            for name, model, owner_id, ip, mac, provisioned in records
+        ]
+        if not params:
+            return []
+        try:
+            db = self._get_db()
+            cur = db.cursor()
+            stmt = "INSERT INTO devices (name, model, owner_id, ip, mac, provisioned) VALUES (?, ?, ?, ?, ?, ?)"
+            cur.executemany(stmt, params)
+            # executemany leaves cursor.lastrowid unset; rows from one
+            # transaction get consecutive ids ending at last_insert_rowid()
+            last_id = db.execute("SELECT last_insert_rowid()").fetchone()[0]
+            db.commit()
+            device_ids = list(range(last_id - len(params) + 1, last_id + 1))
+            for owner_id in {p[2] for p in params}:
+                self._invalidate_devices(owner_id=owner_id)
+            return device_ids
+        except Exception:
+            logger.exception("Exception while bulk adding devices to devices table")
+            return []
+
     def get_devices_for_user(self, owner_id: int):
-        """Return list of device dicts owned by given user id."""
+        """Return list of device dicts owned by given user id (cached per owner)."""
+        with self._device_lock:
+            cached = self._user_devices_cache.get(owner_id)
+            generation = self._device_generation
+        if cached is not None:
+            return [dict(d) for d in cached]
         db = self._get_db()
         query = "SELECT * FROM devices WHERE owner_id = ? ORDER BY id"
         cur = db.execute(query, (owner_id,))
+        devices = [dict(r) for r in cur.fetchall()]
+        with self._device_lock:
+            if generation == self._device_generation:
+                self._user_devices_cache[owner_id] = devices
+                # Seeding the per-id cache also records each device's owner,
+                # which invalidation uses to find the list to drop
+                for device in devices:
+                    self._device_cache.setdefault(device["id"], device)
+        return [dict(d) for d in devices]
+
+    def list_devices(self):
+        """Return list of all device dicts."""
+        db = self._get_db()
+        query = "SELECT * FROM devices ORDER BY id"
+        cur = db.execute(query)
         rows = cur.fetchall()
         return [dict(r) for r in rows]
 
     def get_device_by_id(self, device_id: int) -> Optional[dict]:
+        """Return a device dict by id, served from the device cache when possible."""
+        with self._device_lock:
+            cached = self._device_cache.get(device_id)
+            generation = self._device_generation
+        if cached is not None:
+            return dict(cached)
         db = self._get_db()
         query = "SELECT * FROM devices WHERE id = ? LIMIT 1"
         cur = db.execute(query, (device_id,))
         res = cur.fetchone()
         if not res:
             return None
-        return dict(res)
+        device = dict(res)
+        with self._device_lock:
+            # Don't cache a row read before a concurrent write invalidated it
+            if generation == self._device_generation:
+                self._device_cache[device_id] = device
+        return dict(device)
+
+    def get_device_for_owner(self, device_id: int, owner_id: int) -> Optional[dict]:
+        """Return a device dict by id only if it belongs to owner_id, else None."""
+        with self._device_lock:
+            cached = self._device_cache.get(device_id)
+            generation = self._device_generation
+        if cached is not None:
+            return dict(cached) if cached["owner_id"] == owner_id else None
+        db = self._get_db()
+        query = "SELECT * FROM devices WHERE id = ? AND owner_id = ? LIMIT 1"
+        cur = db.execute(query, (device_id, owner_id))
+        res = cur.fetchone()
+        if not res:
+            return None
+        device = dict(res)
+        with self._device_lock:
+            if generation == self._device_generation:
+                self._device_cache[device_id] = device
+        return dict(device)
+
+    def _invalidate_devices(
+        self, *device_ids: int, owner_id: Optional[int] = None
+    ) -> None:
+        with self._device_lock:
+            self._device_generation += 1
+            if owner_id is not None:
+                self._user_devices_cache.pop(owner_id, None)
+            for device_id in device_ids:
+                cached = self._device_cache.pop(device_id, None)
+                if cached is not None:
+                    self._user_devices_cache.pop(cached["owner_id"], None)
+                elif owner_id is None:
+                    # Owner unknown without a query; drop every cached list
+                    self._user_devices_cache.clear()
 
     def get_device_by_ip(self, ip: str) -> Optional[dict]:
         """Find a device by IP address."""
@@ -212,30 +512,29 @@ class OneLightDB:
 
     def update_device_info(self, device_id: int, **fields) -> bool:
         """Update allowed device fields. Returns True on success."""
-        allowed = {"name", "model", "ip", "mac", "status", "provisioned"}
-        updates = []
-        params = []
-        for k, v in fields.items():
-            if k in allowed:
-                updates.append(f"{k} = ?")
-                params.append(v)
-        if not updates:
+        columns = tuple(sorted(k for k in fields if k in DEVICE_UPDATABLE_FIELDS))
+        if not columns:
             return False
-        params.append(device_id)
-        stmt = f"UPDATE devices SET {', '.join(updates)} WHERE id = ?"
+        stmt = self._update_sql_cache.get(columns)
+        if stmt is None:
+            assignments = ", ".join(f"{k} = ?" for k in columns)
+            stmt = f"UPDATE devices SET {assignments} WHERE id = ?"
+            self._update_sql_cache[columns] = stmt
+        params = tuple(fields[k] for k in columns) + (device_id,)
         try:
             db = self._get_db()
-            db.execute(stmt, tuple(params))
+            db.execute(stmt, params)
             db.commit()
+            self._invalidate_devices(device_id)
             return True
         except Exception:
             logger.exception("Exception while updating device info")
             return False
 
     def update_device_status(
-        self, device_id: int, status: str, last_seen: Optional[str] = None
+        self, device_id: int, status: str, last_seen: Optional[int] = None
     ) -> bool:
-        """Convenience to update status and optionally last_seen timestamp."""
+        """Convenience to update status and optionally last_seen (unix epoch seconds)."""
         try:
             if last_seen:
                 return self.update_device_info(
@@ -245,3 +544,25 @@ class OneLightDB:
         except Exception:
             logger.exception("Exception while updating device status")
             return False
+
+    def update_device_statuses(
+        self, updates: Iterable[Tuple[int, str, Optional[int]]]
+    ) -> bool:
+        """Update status/last_seen for many devices in a single transaction.
+
+        `updates` is an iterable of (device_id, status, last_seen) tuples.
+        """
+        params = [(status, last_seen, device_id) for device_id, status, last_seen in updates]
+        if not params:
+            return True
+        try:
+            db = self._get_db()
+            db.executemany(
+                "UPDATE devices SET status = ?, last_seen = ? WHERE id = ?", params
+            )
+            db.commit()
+            self._invalidate_devices(*(device_id for _, _, device_id in params))
+            return True
+        except Exception:
+            logger.exception("Exception while updating device statuses")
+            return False
@@ -25,12 +25,15 @@ CREATE TABLE IF NOT EXISTS devices (
     ip TEXT,
     mac TEXT,
     status TEXT,
-    last_seen TIMESTAMP,
+    last_seen INTEGER, -- unix epoch seconds
     provisioned INTEGER DEFAULT 0,
     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
     FOREIGN KEY (owner_id) REFERENCES users(id) ON DELETE CASCADE
 );
 
--- Indexes for common lookups
+-- Indexes for common lookups (users.username and users.email are already
+-- indexed by their UNIQUE constraints). Keep in sync with SCHEMA_INDEXES in
+-- database/database.py, which adds them to existing DB files.
 CREATE INDEX IF NOT EXISTS idx_devices_owner ON devices(owner_id);
+CREATE INDEX IF NOT EXISTS idx_devices_ip ON devices(ip);
 CREATE INDEX IF NOT EXISTS idx_devices_mac ON devices(mac);
\ No newline at end of file
@@ -2,9 +2,10 @@
 Docstring for src.utils
 """
 
+import asyncio
 import configparser
+import functools
 import logging
-import re
 import string
 import sys
 import uuid
@@ -13,11 +14,14 @@ from pathlib import Path
 from typing import Any, Literal, Optional, Tuple
 
 import bcrypt
+from argon2 import PasswordHasher
+from argon2.exceptions import InvalidHashError, VerificationError
 from quart import Quart, Request
 
 from database.database import OneLightDB
 
 from constants import (
+    ONELIGHT_LOG_NAME,
     SECRETS_CONFIG_FILE,
     DEV_ENV,
     ENV_KEY,
@@ -27,7 +31,7 @@ from constants import (
 )
 
 
-logger = logging.getLogger("onelight-app")
+logger = logging.getLogger(ONELIGHT_LOG_NAME)
 
 
 GET = "GET"
@@ -39,6 +43,12 @@ PASSWORD_KEY = "password"
 
 PASSWORD_MIN_LENGTH = 8
 
+# Character classes for is_valid_password()
+_UPPER = frozenset(string.ascii_uppercase)
+_LOWER = frozenset(string.ascii_lowercase)
+_DIGIT = frozenset(string.digits)
+_PUNCT = frozenset(string.punctuation)
+
 OK_ZERO = 0
 
 
@@ -88,13 +98,17 @@ def is_valid_password(password: str) -> int:
         return -1
     if len(password) < PASSWORD_MIN_LENGTH:
         return -2
-    if not re.search(r"[A-Z]", password):
+
+    # One C-level pass to build the character set, then a disjointness
+    # check per required character class
+    chars = set(password)
+    if chars.isdisjoint(_UPPER):
         return -3
-    if not re.search(r"[a-z]", password):
+    if chars.isdisjoint(_LOWER):
         return -4
-    if not re.search(f"[{re.escape(string.punctuation)}]", password):
+    if chars.isdisjoint(_PUNCT):
         return -5
-    if not re.search(r"[0-9]", password):
+    if chars.isdisjoint(_DIGIT):
         return -6
     return OK_ZERO
 
@@ -126,38 +140,67 @@ def is_valid_form_fields(request_form: Any, db: OneLightDB) -> Tuple:
         res = is_valid_username(username, db)
         assert res == OK_ZERO
     except Exception:
-        logger.exception(f"Username validation failed (code {res})")
+        logger.exception("Username validation failed (code %s)", res)
         return (FormValidationCodes.US.value, FormValidationCodes.US.name)
     try:
         email: str = request_form.get(EMAIL_KEY)
         res = is_valid_email(email, db)
         assert res == OK_ZERO
     except Exception:
-        logger.exception(f"Email validation failed (code {res})")
+        logger.exception("Email validation failed (code %s)", res)
         return (FormValidationCodes.EM.value, FormValidationCodes.EM.name)
     try:
         password: str = request_form.get(PASSWORD_KEY)
         res = is_valid_password(password)
         assert res == OK_ZERO
     except Exception:
-        logger.exception(f"Password validation failed (code {res})")
+        logger.exception("Password validation failed (code %s)", res)
         return (FormValidationCodes.PW.value, FormValidationCodes.PW.name)
 
     logger.info("[OK] Signup form validation complete")
     return (OK_ZERO, "OK")
 
 
-def hash_signup_password(password: str) -> str:
-    password_bytes: bytes = password.encode(encoding=UTF8)
-    hashed_bytes: bytes = bcrypt.hashpw(password_bytes, bcrypt.gensalt())
-    hashed_str: str = hashed_bytes.decode("utf-8")
-    return hashed_str
+# New passwords are hashed with argon2id; bcrypt hashes from older accounts
+# are still accepted and upgraded on the user's next successful login
+PASSWORD_HASHER = PasswordHasher(time_cost=2, memory_cost=19456, parallelism=1)
+BCRYPT_PREFIXES = ("$2a$", "$2b$", "$2y$")
+
+# Hashes checked against when a login names an unknown user (timing parity).
+# _LEGACY_DUMMY_HASH uses bcrypt's default cost (12), the cost pre-argon2
+# accounts were created with. It's only used while such accounts remain (see
+# login_workflow); once every legacy hash has been upgraded on login, the
+# argon2 dummy alone matches real accounts and this one can be removed.
+_DUMMY_HASH: str = PASSWORD_HASHER.hash("onelight-dummy")
+_LEGACY_DUMMY_HASH: str = bcrypt.hashpw(b"onelight-dummy", bcrypt.gensalt(12)).decode()
+
+
+# Password hashing is deliberately slow, so both helpers run it in a worker
+# thread to keep the event loop serving other requests meanwhile
+async def hash_signup_password(password: str) -> str:
+    return await asyncio.to_thread(PASSWORD_HASHER.hash, password)
+
+
+async def verify_login_password(password: str, stored_hash: str) -> bool:
+    return await asyncio.to_thread(_verify_password, password, stored_hash)
+
+
+def _verify_password(password: str, stored_hash: str) -> bool:
+    if stored_hash.startswith(BCRYPT_PREFIXES):
+        password_bytes: bytes = password.encode(encoding=UTF8)
+        stored_hash_bytes: bytes = stored_hash.encode(encoding=UTF8)
+        return bcrypt.checkpw(password_bytes, stored_hash_bytes)
+    try:
+        return PASSWORD_HASHER.verify(stored_hash, password)
+    except (VerificationError, InvalidHashError):
+        return False
 
 
-def verify_login_password(password: str, stored_hash: str) -> bool:
-    password_bytes: bytes = password.encode(encoding=UTF8)
-    stored_hash_bytes: bytes = stored_hash.encode(encoding=UTF8)
-    return bcrypt.checkpw(password_bytes, stored_hash_bytes)
+def password_needs_rehash(stored_hash: str) -> bool:
+    """True for legacy bcrypt hashes or argon2 hashes with outdated parameters."""
+    if stored_hash.startswith(BCRYPT_PREFIXES):
+        return True
+    return PASSWORD_HASHER.check_needs_rehash(stored_hash)
 
 
 async def signup_workflow(request_form: Any, db: OneLightDB) -> Tuple:
@@ -179,10 +222,11 @@ async def signup_workflow(request_form: Any, db: OneLightDB) -> Tuple:
         return (fields_valid_status, "Invalid username, password or email")
 
     # Continue registration - Make DB entries for user account
+    password_hash: str = await hash_signup_password(request_form.get(PASSWORD_KEY))
     add_account_status_code = db.add_user_account(
         request_form.get(USERNAME_KEY),
         request_form.get(EMAIL_KEY),
-        hash_signup_password(request_form.get(PASSWORD_KEY)),
+        password_hash,
     )
     status_name = FormValidationCodes.UAC.name
     logger.debug(
@@ -216,61 +260,82 @@ async def login_workflow(request_form: Any, db: OneLightDB) -> Tuple:
 
     # Steps:
     #
-    # - check that the username exists in the DB
+    # - fetch the user's id and password hash in a single query
     # - check that the password matches the hashed password associated with
     #   this customer's record
     #
     # - If either condition fails, send a message indicating either field
     #   is invalid, but do not indicate which one exactly
-    is_existing_username: bool = db.username_in_use(username)
-    stored_password_hash: Optional[str] = db.fetch_password_hash_for_username(username)
-    is_matching_password: bool = False
-    if not stored_password_hash:
-        logger.error(f"Password hash for '{username}' could not be found...")
-    else:
-        is_matching_password: bool = verify_login_password(
-            password, stored_password_hash
-        )
+    login_record: Optional[dict] = db.fetch_login_record(username)
+    if not login_record:
+        logger.error("Password hash for '%s' could not be found...", username)
+    # Always verify (against a dummy hash for unknown users) so an unknown
+    # username takes as long as a bad password
+    stored_hash: str = login_record["password_hash"] if login_record else _DUMMY_HASH
+    is_matching_password: bool = (
+        await verify_login_password(password, stored_hash) and login_record is not None
+    )
+    # While bcrypt accounts remain, bcrypt (~10x slower) and argon2 accounts
+    # would be told apart by timing. Pad every attempt with the scheme it
+    # didn't use, so unknown, bcrypt and argon2 users all cost one of each.
+    if db.legacy_password_hashes_remain():
+        if stored_hash.startswith(BCRYPT_PREFIXES):
+            await verify_login_password(password, _DUMMY_HASH)
+        else:
+            await verify_login_password(password, _LEGACY_DUMMY_HASH)
 
     login_fail_message: str = "Invalid username or password, please try again."
-    if not is_existing_username or not is_matching_password:
-        return (-1, login_fail_message)
-    # Fetch the user's DB record so the caller can bind session to user id
-    user_record = db.fetch_user_by_username(username)
-    if not user_record:
+    if not is_matching_password:
         return (-1, login_fail_message)
 
-    return (0, user_record.get("id"))
+    # Upgrade legacy (bcrypt) or outdated hashes now that we have the password
+    if password_needs_rehash(login_record["password_hash"]):
+        new_hash: str = await hash_signup_password(password)
+        if not db.update_password_hash(login_record["id"], new_hash):
+            logger.warning("Could not upgrade password hash for '%s'", username)
+
+    # String form of the id, ready to use as the AuthUser auth_id
+    return (0, str(login_record["id"]))
 
 
 # Config helper
+_config_cache: Optional[configparser.ConfigParser] = None
+
+
+def _load_config() -> configparser.ConfigParser:
+    """Read SECRETS_CONFIG_FILE once and return the cached parser."""
+    global _config_cache
+    if _config_cache is None:
+        config = configparser.ConfigParser()
+        config.read(Path(SECRETS_CONFIG_FILE).resolve())
+        _config_cache = config
+    return _config_cache
+
+
+@functools.lru_cache(maxsize=4)
 def get_secret_key(env: str):
     try:
         assert env in ("dev", "prod")
     except AssertionError:
-        logger.error(f"Invalid application environment ('{env}')")
+        logger.error("Invalid application environment ('%s')", env)
         raise
 
-    config_path = Path(SECRETS_CONFIG_FILE).resolve()
-    config = configparser.ConfigParser()
-    config.read(config_path)
+    config = _load_config()
 
     try:
         key = config["SECRETS"][f"{env}_secret_key"]
-        logger.debug(f"Is secret key None? {key is None}")
+        logger.debug("Is secret key None? %s", key is None)
         return key
     except Exception:
         logger.exception(
-            f"Exception returning secret key for env '{env}'. Returning None"
+            "Exception returning secret key for env '%s'. Returning None", env
         )
         raise
 
 
 # Config helper
 def get_app_env(sys_argv=None):
-    config_path = Path(SECRETS_CONFIG_FILE)
-    config = configparser.ConfigParser()
-    config.read(config_path)
+    config = _load_config()
 
     try:
         return config["CONFIG"]["env"]
@@ -283,21 +348,22 @@ def get_app_env(sys_argv=None):
             elif env.startswith("prod"):
                 env = "prod"
             else:
-                logger.debug(f"Invalid env CLI param '{env}'")
+                logger.debug("Invalid env CLI param '%s'", env)
                 env = "dev"
         else:
-            logger.debug(f"Invalid env CLI param '{env}'")
+            logger.debug("Invalid env CLI param '%s'", env)
             env = "dev"
+        return env
     except Exception:
         logger.exception(
-            f"Exception returning env param from '{SECRETS_CONFIG_FILE}' file"
+            "Exception returning env param from '%s' file", SECRETS_CONFIG_FILE
         )
         raise
 
 
 # Update app config based on env
 def update_app_config(app: Quart, env: Optional[str]):
-    logger.debug(f"Using application env '{env}'")
+    logger.debug("Using application env '%s'", env)
 
     if env == PROD_ENV:
         app.config.update(
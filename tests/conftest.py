@@ -0,0 +1,25 @@
+try:
+    import uvloop
+except ImportError:  # optional; tests fall back to the stdlib event loop
+    uvloop = None
+
+try:
+    from pytest_asyncio.plugin import PytestAsyncioSpecs
+except ImportError:  # pytest-asyncio < 1.3 has no loop-factory hookspec
+    PytestAsyncioSpecs = None
+
+
+# Older pytest-asyncio rejects an unknown pytest_asyncio_* hook, so only
+# define it when the installed plugin declares the hookspec
+if uvloop is not None and hasattr(PytestAsyncioSpecs, "pytest_asyncio_loop_factories"):
+
+    def pytest_asyncio_loop_factories(config, item):
+        # Run async tests on uvloop's libuv-backed loop when it's installed
+        return {"uvloop": uvloop.new_event_loop}
+
+
+def pytest_configure(config):
+    # Registered here too so the marks don't warn when pytest-xdist is absent
+    config.addinivalue_line(
+        "markers", "xdist_group(name): run these tests on the same xdist worker"
+    )
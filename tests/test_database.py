@@ -0,0 +1,166 @@
+import asyncio
+import shutil
+from pathlib import Path
+
+import pytest
+import pytest_asyncio
+from quart import Quart
+
+from database.database import OneLightDB, INIT_SCHEMA_PATH
+
+SRC = Path(__file__).resolve().parents[1] / "src"
+
+
+@pytest.fixture
+def app(tmp_path):
+    shutil.copy(SRC / INIT_SCHEMA_PATH, tmp_path / INIT_SCHEMA_PATH)
+    return Quart(__name__, root_path=str(tmp_path))
+
+
+@pytest_asyncio.fixture
+async def db(app):
+    db = OneLightDB(app)
+    async with app.app_context():
+        yield db
+
+
+@pytest.mark.asyncio
+async def test_username_lookup_is_cached_and_updated_on_signup(db):
+    assert db.username_in_use("alice") is False
+    assert db.add_user_account("alice", "alice@example.com", "hash") == 0
+    # add_user_account refreshes the cached negative lookups
+    assert db.username_in_use("alice") is True
+    assert db.email_in_use("alice@example.com") is True
+
+
+@pytest.mark.asyncio
+async def test_connections_are_returned_to_pool(app):
+    db = OneLightDB(app)
+    async with app.app_context():
+        first = db._get_db()
+    async with app.app_context():
+        assert db._get_db() is first
+
+
+@pytest.mark.asyncio
+async def test_worker_thread_reuses_context_connection(app):
+    db = OneLightDB(app)
+    async with app.app_context():
+        db.ensure_connection()
+        engine = await asyncio.to_thread(db._get_db)
+        assert engine is db._get_db()
+    assert db._pool.get_nowait() is engine
+
+
+@pytest.mark.asyncio
+async def test_gathered_db_calls_return_connection_to_pool(app):
+    from api.device_manager import DeviceManager
+
+    db = OneLightDB(app)
+    dm = DeviceManager(db)
+    opened = []
+    connect = db._connect_db
+    db._connect_db = lambda: opened.append(1) or connect()
+
+    @app.route("/fanout")
+    async def fanout():
+        # First DB access happens inside the gathered child tasks
+        await asyncio.gather(*(dm._db(db.list_devices) for _ in range(3)))
+        return "ok"
+
+    client = app.test_client()
+    for _ in range(5):
+        assert (await client.get("/fanout")).status_code == 200
+    assert len(opened) == 1
+    assert db._pool.qsize() == 1
+
+
+@pytest.mark.asyncio
+async def test_update_device_info_ignores_unknown_fields(db):
+    db.add_user_account("alice", "alice@example.com", "hash")
+    device_id = db.add_device("Plug", "HS100", owner_id=1, ip="192.168.1.50")
+
+    assert db.update_device_info(device_id, owner_id=2) is False
+    assert db.update_device_info(device_id, status="on", name="Lamp", owner_id=2)
+    device = db.get_device_by_id(device_id)
+    assert (device["name"], device["status"], device["owner_id"]) == ("Lamp", "on", 1)
+
+
+@pytest.mark.asyncio
+async def test_device_cache_is_invalidated_on_write(db):
+    db.add_user_account("alice", "alice@example.com", "hash")
+    device_id = db.add_device("Plug", "HS100", owner_id=1, ip="192.168.1.50")
+
+    assert db.get_device_by_id(device_id)["status"] is None
+    db.update_device_status(device_id, "on", last_seen=100)
+    assert db.get_device_by_id(device_id)["status"] == "on"
+    db.update_device_statuses([(device_id, "off", 200)])
+    assert db.get_device_by_id(device_id)["last_seen"] == 200
+
+
+@pytest.mark.asyncio
+async def test_user_device_list_is_invalidated_on_write(db):
+    db.add_user_account("alice", "alice@example.com", "hash")
+    first = db.add_device("Plug", "HS100", owner_id=1)
+
+    assert [d["id"] for d in db.get_devices_for_user(1)] == [first]
+    second = db.add_device("Lamp", "HS100", owner_id=1)
+    assert [d["id"] for d in db.get_devices_for_user(1)] == [first, second]
+    db.update_device_status(second, "on")
+    assert db.get_devices_for_user(1)[1]["status"] == "on"
+    db.update_device_info(first, name="Desk")
+    assert db.get_devices_for_user(1)[0]["name"] == "Desk"
+
+
+@pytest.mark.asyncio
+async def test_get_device_for_owner_hides_other_owners_devices(db):
+    db.add_user_account("alice", "alice@example.com", "hash")
+    db.add_user_account("bob", "bob@example.com", "hash")
+    device_id = db.add_device("Plug", "HS100", owner_id=1)
+
+    assert db.get_device_for_owner(device_id, 2) is None
+    assert db.get_device_for_owner(device_id, 1)["id"] == device_id
+    # Served from the device cache on the second lookup
+    assert db.get_device_for_owner(device_id, 2) is None
+    assert db.get_device_for_owner(device_id + 1, 1) is None
+
+
+@pytest.mark.asyncio
+async def test_existing_database_gains_missing_indexes(app):
+    db = OneLightDB(app)
+    async with app.app_context():
+        db._get_db().execute("DROP INDEX idx_devices_ip")
+
+    db = OneLightDB(app)
+    async with app.app_context():
+        rows = db._get_db().execute(
+            "SELECT name FROM sqlite_master WHERE type = 'index' AND tbl_name = 'devices'"
+        )
+        assert "idx_devices_ip" in {row[0] for row in rows}
+
+
+@pytest.mark.asyncio
+async def test_add_devices_bulk_returns_new_ids(db):
+    db.add_user_account("alice", "alice@example.com", "hash")
+    first = db.add_device("Plug", "HS100", owner_id=1)
+    assert len(db.get_devices_for_user(1)) == 1
+
+    ids = db.add_devices_bulk(
+        [
+            ("Lamp", "HS100", 1, "192.168.1.51", None, True),
+            ("Fan", "HS103", 1, "192.168.1.52", None, True),
+        ]
+    )
+    assert ids == [first + 1, first + 2]
+    assert [d["name"] for d in db.get_devices_for_user(1)] == ["Plug", "Lamp", "Fan"]
+    assert db.add_devices_bulk([]) == []
+
+
+@pytest.mark.asyncio
+async def test_legacy_password_hash_flag_clears_after_last_upgrade(db):
+    db.add_user_account("alice", "alice@example.com", "$2b$12$legacy")
+    assert db.legacy_password_hashes_remain() is True
+
+    user_id = db.fetch_login_record("alice")["id"]
+    db.update_password_hash(user_id, "$argon2id$v=19$upgraded")
+    assert db.legacy_password_hashes_remain() is False
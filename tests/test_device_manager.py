@@ -1,84 +1,148 @@
 import pytest
 import asyncio
+import types
 
+from api import device_manager
 from api.device_manager import DeviceManager
 
+# Event-loop-bound tests share one worker under `pytest -n auto --dist loadgroup`
+pytestmark = pytest.mark.xdist_group("async")
+
+
+_DEVICE_FIELDS = (
+    "id",
+    "name",
+    "model",
+    "owner_id",
+    "ip",
+    "mac",
+    "provisioned",
+    "status",
+    "last_seen",
+)
+
 
 class FakeDB:
+    """In-memory devices table stored column-wise; device N lives at index N-1."""
+
+    __slots__ = ("_columns",)
+
     def __init__(self):
-        self._devices = {}
-        self._next = 1
+        self._columns = {field: [] for field in _DEVICE_FIELDS}
+
+    def _row(self, index):
+        return {field: column[index] for field, column in self._columns.items()}
+
+    def _index(self, device_id):
+        if 0 < device_id <= len(self._columns["id"]):
+            return device_id - 1
+        return None
+
+    def ensure_connection(self):
+        pass
 
     def add_device(self, name, model, owner_id, ip=None, mac=None, provisioned=False):
-        did = self._next
-        self._next += 1
-        self._devices[did] = {
-            "id": did,
-            "name": name,
-            "model": model,
-            "owner_id": owner_id,
-            "ip": ip,
-            "mac": mac,
-            "provisioned": int(bool(provisioned)),
-            "status": None,
-            "last_seen": None,
-        }
+        did = len(self._columns["id"]) + 1
+        values = (did, name, model, owner_id, ip, mac, bool(provisioned), None, None)
+        for field, value in zip(_DEVICE_FIELDS, values):
+            self._columns[field].append(value)
         return did
 
     def get_device_by_id(self, device_id):
-        return self._devices.get(device_id)
+        index = self._index(device_id)
+        return None if index is None else self._row(index)
+
+    def list_devices(self):
+        return [self._row(i) for i in range(len(self._columns["id"]))]
+
+    def _find(self, field, value):
+        try:
+            return self._row(self._columns[field].index(value))
+        except ValueError:
+            return None
+
+    def get_device_by_ip(self, ip):
+        return self._find("ip", ip)
+
+    def get_device_by_mac(self, mac):
+        return self._find("mac", mac)
 
     def update_device_status(self, device_id, status, last_seen=None):
-        if device_id in self._devices:
-            self._devices[device_id]["status"] = status
-            self._devices[device_id]["last_seen"] = last_seen
-            return True
-        return False
+        index = self._index(device_id)
+        if index is None:
+            return False
+        self._columns["status"][index] = status
+        # Like the real DB: a falsy last_seen leaves the stored value alone
+        if last_seen:
+            self._columns["last_seen"][index] = last_seen
+        return True
+
+    def update_device_statuses(self, updates):
+        for device_id, status, last_seen in updates:
+            index = self._index(device_id)
+            if index is not None:
+                self._columns["status"][index] = status
+                self._columns["last_seen"][index] = last_seen
+        return True
+
+
+@pytest.fixture
+def dm():
+    # Function-scoped: provisioning/status tests mutate the fake DB
+    return DeviceManager(FakeDB())
+
+
+def _resolved(result):
+    """Already-completed future, so stub adapter calls skip building a coroutine."""
+    future = asyncio.get_running_loop().create_future()
+    future.set_result(result)
+    return future
+
+
+def fake_device(mac, model):
+    """Stand-in for the Device objects returned by kasa discovery."""
+    config = types.SimpleNamespace(to_dict=lambda: {"host": "192.168.1.50"})
+    return types.SimpleNamespace(mac=mac, model=model, config=config)
+
+
+# What FakeDiscover.discover() reports; built once and shared (never mutated)
+_DISCOVERY_PAYLOAD = {"192.168.1.50": fake_device("aa:bb:cc:dd:ee:ff", "HS100")}
 
 
 @pytest.mark.asyncio
-async def test_discover_presents_candidates(monkeypatch):
-    # Patch kasa.Discover.discover to return a fake device
+async def test_discover_presents_candidates(monkeypatch, dm):
+    # Patch Discover.discover to return a fake device; a plain function
+    # handing back a completed future is just as awaitable as a coroutine
     class FakeDiscover:
         @staticmethod
-        async def discover(timeout=5):
-            return {
-                "192.168.1.50": {
-                    "sys_info": {"mac": "aa:bb:cc:dd:ee:ff", "model": "HS100"}
-                }
-            }
-
-    monkeypatch.setitem(
-        __import__("sys").modules,
-        "kasa",
-        __import__("types").SimpleNamespace(Discover=FakeDiscover),
-    )
+        def discover(target=None, **kwargs):
+            return _resolved(_DISCOVERY_PAYLOAD)
+
+    monkeypatch.setattr(device_manager, "Discover", FakeDiscover)
 
-    db = FakeDB()
-    dm = DeviceManager(db)
     results = await dm.discover(timeout=1)
     assert isinstance(results, list)
-    assert any(r.get("ip") == "192.168.1.50" for r in results)
+    ips = {r.get("ip") for r in results}
+    assert "192.168.1.50" in ips
 
 
 @pytest.mark.asyncio
-async def test_provision_and_control(monkeypatch):
-    db = FakeDB()
-    dm = DeviceManager(db)
-
+async def test_provision_and_control(monkeypatch, dm):
     # Monkeypatch adapter creation to avoid network calls
     class StubAdapter:
+        __slots__ = ("ip",)
+
         def __init__(self, ip):
             self.ip = ip
 
-        async def turn_on(self):
-            return None
+        def turn_on(self):
+            return _resolved(None)
 
-        async def turn_off(self):
-            return None
+        def turn_off(self):
+            return _resolved(None)
 
-        async def get_state(self):
-            return {"is_on": True}
+        def get_state(self):
+            return _resolved({"is_on": True})
 
     monkeypatch.setattr(
         dm, "_adapter_for_device", lambda device: StubAdapter(device.get("ip"))
@@ -88,8 +152,252 @@ async def test_provision_and_control(monkeypatch):
     device_id = await dm.provision(discovery, owner_id=1, name="Test Plug")
     assert device_id != -1
 
-    # Turn on/off and get state
+    # Turn on/off and get state; on must land before off, the read can overlap
     await dm.turn_on(device_id)
-    await dm.turn_off(device_id)
-    state = await dm.get_state(device_id)
+    _, state = await asyncio.gather(dm.turn_off(device_id), dm.get_state(device_id))
     assert isinstance(state, dict)
+
+
+def test_broadcast_target_is_cached(monkeypatch):
+    calls = []
+
+    def fake_detect():
+        calls.append(1)
+        return "192.168.1.255"
+
+    monkeypatch.setattr(device_manager, "_detect_broadcast_target", fake_detect)
+    # Start empty, and restore the module-level cache afterwards so the fake
+    # target doesn't leak into later tests
+    monkeypatch.setitem(device_manager._BROADCAST_CACHE, "value", None)
+    monkeypatch.setitem(device_manager._BROADCAST_CACHE, "expires", 0.0)
+
+    assert device_manager.get_broadcast_target() == "192.168.1.255"
+    assert device_manager.get_broadcast_target() == "192.168.1.255"
+    assert len(calls) == 1
+
+    device_manager.invalidate_broadcast_cache()
+    device_manager.get_broadcast_target()
+    assert len(calls) == 2
+
+
+@pytest.mark.asyncio
+async def test_kasa_adapter_raises_failed_command_without_retry(monkeypatch):
+    from api.device_manager import KasaAdapter
+
+    created = []
+
+    class FlakyPlug:
+        def __init__(self, ip):
+            self.ip = ip
+            self.is_on = False
+            self.fail = not created
+            created.append(self)
+
+        async def update(self):
+            return None
+
+        async def disconnect(self):
+            return None
+
+        async def turn_on(self):
+            if self.fail:
+                raise ConnectionError("stale connection")
+            self.is_on = True
+
+    monkeypatch.setattr(device_manager, "IotPlug", FlakyPlug)
+
+    adapter = KasaAdapter("192.168.1.50")
+    with pytest.raises(ConnectionError):
+        await adapter.turn_on()
+    assert len(created) == 1
+
+    # DeviceManager evicts the failed adapter; a fresh one reconnects
+    adapter = KasaAdapter("192.168.1.50")
+    await adapter.turn_on()
+    assert len(created) == 2
+    assert (await adapter.get_state()) == {"is_on": True}
+
+
+@pytest.mark.asyncio
+async def test_get_states_refreshes_all_devices(monkeypatch, dm):
+    db = dm.db
+
+    class StubAdapter:
+        __slots__ = ("ip",)
+
+        def __init__(self, ip):
+            self.ip = ip
+
+        def get_state(self):
+            return _resolved({"is_on": self.ip.endswith(".50")})
+
+    monkeypatch.setattr(
+        dm, "_adapter_for_device", lambda device: StubAdapter(device.get("ip"))
+    )
+
+    first = db.add_device("Plug A", "HS100", owner_id=1, ip="192.168.1.50")
+    second = db.add_device("Plug B", "HS100", owner_id=1, ip="192.168.1.51")
+
+    states = await dm.get_states([first, second, 999])
+    assert states == {first: {"is_on": True}, second: {"is_on": False}}
+    assert db.get_device_by_id(first)["status"] == "on"
+    assert db.get_device_by_id(second)["status"] == "off"
+
+
+
+@pytest.mark.asyncio
+async def test_get_states_marks_unreachable_devices_unknown(monkeypatch, dm):
+    db = dm.db
+
+    class StubAdapter:
+        __slots__ = ()
+
+        def get_state(self):
+            return _resolved({"is_on": True})
+
+    reachable = db.add_device("Plug A", "HS100", owner_id=1, ip="192.168.1.50")
+    no_ip = db.add_device("Plug B", "HS100", owner_id=1)
+    real_adapter_for_device = dm._adapter_for_device
+    monkeypatch.setattr(
+        dm,
+        "_adapter_for_device",
+        lambda device: StubAdapter()
+        if device.get("ip")
+        else real_adapter_for_device(device),
+    )
+
+    states = await dm.get_states([reachable, no_ip])
+    assert states == {reachable: {"is_on": True}}
+    assert db.get_device_by_id(reachable)["status"] == "on"
+    assert db.get_device_by_id(no_ip)["status"] == "unknown"
+
+@pytest.mark.asyncio
+async def test_refresh_known_probes_registered_ips(monkeypatch, dm):
+    probed = []
+    disconnected = []
+
+    class DiscoveredPlug:
+        # Like kasa's discovery result: is_on is only accurate after update()
+        def __init__(self, host):
+            self.host = host
+            self.is_on = False
+
+        async def update(self):
+            self.is_on = True
+
+        async def disconnect(self):
+            disconnected.append(self.host)
+
+    class FakeDiscover:
+        @staticmethod
+        async def discover_single(host, discovery_timeout=5):
+            probed.append(host)
+            if host == "192.168.1.51":
+                raise TimeoutError("no answer")
+            if host == "192.168.1.52":
+                await asyncio.sleep(10)
+            return DiscoveredPlug(host)
+
+    monkeypatch.setattr(device_manager, "Discover", FakeDiscover)
+
+    db = dm.db
+    first = db.add_device("Plug A", "HS100", owner_id=1, ip="192.168.1.50")
+    db.add_device("Plug B", "HS100", owner_id=1, ip="192.168.1.51")
+    db.add_device("Plug C", "HS100", owner_id=1, ip="192.168.1.52")
+
+    # The hung probe is cut off by the per-probe timeout
+    refreshed = await dm.refresh_known(timeout=0.05)
+    assert sorted(probed) == ["192.168.1.50", "192.168.1.51", "192.168.1.52"]
+    assert refreshed == {first: {"is_on": True}}
+    assert db.get_device_by_id(first)["status"] == "on"
+    assert disconnected == ["192.168.1.50"]
+
+
+def test_adapter_cache_evicts_lru_and_expired():
+    from api.device_manager import AdapterCache
+
+    evicted = []
+    cache = AdapterCache(maxsize=2, ttl=60.0, on_evict=evicted.append)
+    cache.set(1, "a")
+    cache.set(2, "b")
+    assert cache.get(1) == "a"
+    cache.set(3, "c")
+    assert evicted == ["b"]
+    assert 2 not in cache
+
+    cache.ttl = -1.0
+    assert cache.get(1) is None
+    assert evicted == ["b", "a"]
+
+
+@pytest.mark.asyncio
+async def test_failed_turn_on_marks_status_unknown(monkeypatch, dm):
+    db = dm.db
+
+    class FailingAdapter:
+        async def turn_on(self):
+            raise ConnectionError("unreachable")
+
+    monkeypatch.setattr(dm, "_adapter_for_device", lambda device: FailingAdapter())
+
+    device_id = db.add_device("Plug", "HS100", owner_id=1, ip="192.168.1.50")
+    db.update_device_status(device_id, "off", last_seen=1_000)
+    with pytest.raises(ConnectionError):
+        await dm.turn_on(device_id)
+    device = db.get_device_by_id(device_id)
+    assert device["status"] == "unknown"
+    # The failed command must not leave the optimistic last_seen behind
+    assert device["last_seen"] == 1_000
+
+
+@pytest.mark.asyncio
+async def test_concurrent_scans_share_one_broadcast(monkeypatch, dm):
+    calls = []
+
+    class FakeDiscover:
+        @staticmethod
+        async def discover(target=None, **kwargs):
+            calls.append(target)
+            await asyncio.sleep(0.01)
+            return _DISCOVERY_PAYLOAD
+
+    monkeypatch.setattr(device_manager, "Discover", FakeDiscover)
+
+    first, second = await asyncio.gather(dm.discover_new(), dm.discover_new())
+    assert len(calls) == 1
+    assert first == second
+
+
+@pytest.mark.asyncio
+async def test_discovery_returns_once_replies_stop(monkeypatch):
+    class SlowDiscover:
+        @staticmethod
+        async def discover(on_discovered=None, discovery_timeout=5, **kwargs):
+            await on_discovered(types.SimpleNamespace(host="192.168.1.50"))
+            await asyncio.sleep(discovery_timeout)
+            return {}
+
+    monkeypatch.setattr(device_manager, "Discover", SlowDiscover)
+
+    loop = asyncio.get_running_loop()
+    started = loop.time()
+    found = await device_manager._discover_until_quiet(5, quiet=0.05)
+    assert list(found) == ["192.168.1.50"]
+    assert loop.time() - started < 1
+
+
+@pytest.mark.asyncio
+async def test_evicted_adapter_close_task_is_held_until_done():
+    closed = []
+
+    class ClosingAdapter(device_manager.DeviceAdapter):
+        async def close(self):
+            await asyncio.sleep(0)
+            closed.append(self)
+
+    adapter = ClosingAdapter()
+    device_manager._close_adapter(adapter)
+    assert len(device_manager._CLOSE_TASKS) == 1
+    await asyncio.gather(*device_manager._CLOSE_TASKS)
+    assert closed == [adapter]
+    assert not device_manager._CLOSE_TASKS
@@ -0,0 +1,68 @@
+import pytest
+
+from api import smart_device_manager
+
+
+class FakeDevice:
+    def __init__(self, host):
+        self.host = host
+        self.is_on = False
+        self.calls = []
+
+    async def turn_on(self):
+        self.calls.append("turn_on")
+        self.is_on = True
+
+    async def update(self):
+        self.calls.append("update")
+
+
+@pytest.mark.asyncio
+async def test_state_read_after_write_skips_update(monkeypatch):
+    monkeypatch.setattr(smart_device_manager, "Device", FakeDevice)
+    monkeypatch.setattr(smart_device_manager, "_LAST_STATE", {})
+
+    device = FakeDevice("192.168.1.50")
+    await smart_device_manager.turn_on_hs100(device)
+    # A second press right after the first is debounced
+    await smart_device_manager.turn_on_hs100(device)
+    state = await smart_device_manager.get_hs100_on_state(device)
+
+    assert state == "hs100: ON"
+    assert device.calls == ["turn_on"]
+
+
+def test_load_config_rereads_only_on_change(tmp_path, monkeypatch):
+    monkeypatch.setattr(smart_device_manager, "_CONFIG_CACHE", {})
+    path = tmp_path / "config.json"
+
+    assert smart_device_manager.load_config(path) == {}
+
+    path.write_text('{"hs100": {"mac": "AA:BB"}}')
+    first = smart_device_manager.load_config(path)
+    assert first == {"hs100": {"mac": "AA:BB"}}
+    assert smart_device_manager.load_config(path) is first
+
+
+@pytest.mark.asyncio
+async def test_unresponsive_cached_device_is_invalidated(monkeypatch):
+    class DeadDevice(FakeDevice):
+        async def update(self):
+            raise ConnectionError("gone")
+
+        async def disconnect(self):
+            self.calls.append("disconnect")
+
+    monkeypatch.setattr(smart_device_manager, "Device", FakeDevice)
+    monkeypatch.setattr(smart_device_manager, "_LAST_STATE", {})
+
+    dead, alive = DeadDevice("192.168.1.50"), FakeDevice("192.168.1.51")
+    monkeypatch.setitem(
+        smart_device_manager.device_cache,
+        "hs100",
+        {dead.host: dead, alive.host: alive},
+    )
+
+    assert await smart_device_manager.get_hs100_device() is alive
+    assert dead.calls == ["disconnect"]
+    assert list(smart_device_manager.device_cache["hs100"]) == [alive.host]